@@ -5,10 +5,69 @@ import cv2
 import yaml
 import pandas as pd
 import json
+from numba import njit
 from scipy.signal import savgol_filter
 from models.AbstractBannerReplacer import AbstractBannerReplacer
 
 
+@njit(cache=True)
+def _correct(unstable_left, unstable_right, x_top_left_arr, x_top_right_arr, x_bot_left_arr, x_bot_right_arr,
+             left_height_arr, right_height_arr, angle_arr, ratio_arr, ratio):
+    '''
+    The function corrects X coordinates of the side which was lost on unstable frames
+    :unstable_left: 1 for frames where left side of the banner is unstable
+    :unstable_right: 1 for frames where right side of the banner is unstable
+    :x_top_left_arr, x_top_right_arr, x_bot_left_arr, x_bot_right_arr: X coordinates of corners, changed in place
+    :left_height_arr, right_height_arr: heights of banner sides
+    :angle_arr: angle of top left corner in degrees
+    :ratio_arr: ratio of banner top width to left height
+    :ratio: expected ratio of the banner
+    :return: corrected X coordinates
+    '''
+    points_num = x_top_left_arr.shape[0]
+
+    # 0 - no unstable side yet, 1 - left side, 2 - right side
+    latest_unstable = 0
+    for x in range(points_num):
+        x_top_left = x_top_left_arr[x]
+        x_bot_left = x_bot_left_arr[x]
+        x_top_right = x_top_right_arr[x]
+        x_bot_right = x_bot_right_arr[x]
+
+        if unstable_right[x]:
+            latest_unstable = 2
+            for position in range(max(x - 10, 0), min(x + 10, points_num)):
+                x_top_left = x_top_left_arr[position]
+                x_bot_left = x_bot_left_arr[position]
+
+                shift = left_height_arr[position] * (ratio * angle_arr[position] / 90)
+                x_top_right_arr[position] = x_top_left + shift
+                x_bot_right_arr[position] = x_bot_left + shift
+
+        if unstable_left[x]:
+            latest_unstable = 1
+            for position in range(max(x - 10, 0), min(x + 10, points_num)):
+                x_top_right = x_top_right_arr[position]
+                x_bot_right = x_bot_right_arr[position]
+
+                shift = right_height_arr[position] * (ratio * angle_arr[position] / 90)
+                x_top_left_arr[position] = x_top_right - shift
+                x_bot_left_arr[position] = x_bot_right - shift
+
+        if abs(ratio_arr[x] - ratio) > 0.05:
+            if latest_unstable == 1 and x_top_right <= 1278:
+                shift = right_height_arr[x] * (ratio * angle_arr[x] / 90)
+                x_top_left_arr[x] = x_top_right - shift
+                x_bot_left_arr[x] = x_bot_right - shift
+
+            if latest_unstable == 2 and x_top_left >= 2:
+                shift = left_height_arr[x] * (ratio * angle_arr[x] / 90)
+                x_top_right_arr[x] = x_top_left + shift
+                x_bot_right_arr[x] = x_bot_left + shift
+
+    return x_top_left_arr, x_top_right_arr, x_bot_left_arr, x_bot_right_arr
+
+
 class UnetLogoInsertion(AbstractBannerReplacer):
     '''
     The model detects banner and replace it with other logo using Unet neural network model
@@ -16,11 +75,26 @@ class UnetLogoInsertion(AbstractBannerReplacer):
 
     def __init__(self):
         self.model = None
-        self.detected_mask = None
+        self.predict_fn = None
         self.detection_successful = False
         self.frame = None
         self.model_parameters = None
+        self.img_height = None
+        self.img_width = None
+        self.full_size_step = None
+        self.predict_batch_size = None
+        self.value_threshold = None
+        self.filter_area_size = None
+        self.min_window = None
+        self.max_window = None
+        self.poly_degree = None
+        self.smooth_threshold = None
         self.corners = None
+        self.logo = None
+        self.logo_hsv = None
+        self.logo_pts1 = None
+        self.adjusted_logo_hsv = None
+        self.mean_logo_s = None
         self.old_width = None
         self.center_left = None
         self.center_right = None
@@ -30,6 +104,8 @@ class UnetLogoInsertion(AbstractBannerReplacer):
         self.saved_points = pd.DataFrame(columns=['x_top_left', 'y_top_left', 'x_top_right',
                                                   'y_top_right', 'x_bot_left', 'y_bot_left',
                                                   'x_bot_right', 'y_bot_right'])
+        self.points_rows = []
+        self.points_index = []
 
     def build_model(self, parameters_filepath):
         '''
@@ -66,37 +142,52 @@ class UnetLogoInsertion(AbstractBannerReplacer):
         # load trained model weights
         self.model.load_weights(model_weights_path)
 
+        # rebuild the model with float16 computations for faster inference if required
+        if self.model_parameters.get('fp16_inference', False):
+            self.model = self.__build_fp16_model(model_json)
+
+        # compiled graph for prediction with fixed input signature to avoid retracing
+        self.predict_fn = tf.function(lambda x: self.model(x, training=False), experimental_compile=True,
+                                      input_signature=[tf.TensorSpec([None, img_height, img_width, img_channels],
+                                                                     tf.float32)])
+
+        # saving frequently used parameters to class attributes
+        self.img_height = img_height
+        self.img_width = img_width
+        self.full_size_step = self.model_parameters['full_size_step']
+        self.predict_batch_size = self.model_parameters.get('predict_batch_size', 32)
+        self.value_threshold = self.model_parameters['value_threshold']
+        self.filter_area_size = self.model_parameters['filter_area_size']
+        self.min_window = self.model_parameters['min_window']
+        self.max_window = self.model_parameters['max_window']
+        self.poly_degree = self.model_parameters['poly_degree']
+        self.smooth_threshold = self.model_parameters['smooth_threshold']
+
     def detect_banner(self, frame):
         '''
-        This method detects banner's pixels using Unet model, and saves deteсted binary mask
-        and saves coordinates for top left and bottom right corners of a banner
+        This method detects banner's pixels using Unet model
+        and saves coordinates for corners of a banner
         :frame: image or video frame where we will make detection and insertion
         '''
         self.frame = frame
 
         if self.before_smoothing:
             # load parameters
-            value_threshold = self.model_parameters['value_threshold']
+            value_threshold = self.value_threshold
 
             # getting full size predicted mask of the frame
             fsz_mask = self.__predict_full_size()
-            fsz_mask = (fsz_mask > value_threshold).astype(np.uint8)
+            fsz_mask = np.where(fsz_mask[..., 0] > value_threshold, np.uint8(255), np.uint8(0))
 
             # check contours and detect corner points
             self.__check_contours(fsz_mask)
 
         else:
-            # loading detected mask
-            self.detected_mask = np.load('saved_frame_mask/frame{}.npy'.format(self.frame_num))
+            # load smoothed points
+            self.__load_points()
 
             # check if there is detected area on the frame
-            if len(self.detected_mask) == 1:
-                self.detection_successful = False
-
-            else:
-                # load smoothed points
-                self.__load_points()
-                self.detection_successful = True
+            self.detection_successful = self.corners is not None
 
         self.frame_num += 1
 
@@ -107,101 +198,114 @@ class UnetLogoInsertion(AbstractBannerReplacer):
         if not self.detection_successful:
             return
 
-        # load logo
-        logo = cv2.imread(self.model_parameters['logo_link'], cv2.IMREAD_UNCHANGED)
+        # load logo, it doesn't change between frames so it is read only once
+        if self.logo is None:
+            self.logo = cv2.imread(self.model_parameters['logo_link'], cv2.IMREAD_UNCHANGED)
 
         # adjust logo color to banner's environment
-        logo = self.__logo_color_adj(logo)
+        logo = self.__logo_color_adj(self.logo)
 
         # adjust logo to banner's shape
         transformed_logo = self.__adjust_logo_shape(logo)
 
         # replacing banner pixels with logo pixels
-        for k in range(self.frame.shape[0]):
-            for j in range(self.frame.shape[1]):
-                if self.detected_mask[k, j] == 1:
-                    self.frame[k, j] = transformed_logo[k, j]
+        banner_mask = np.zeros(self.frame.shape[:2], dtype=np.uint8)
+        banner_polygon = np.int32(np.rint(self.corners[[0, 2, 1, 3]]))
+        cv2.fillPoly(banner_mask, [banner_polygon], 1)
+        np.copyto(self.frame, transformed_logo[..., :3], where=banner_mask.view(bool)[..., np.newaxis])
 
     def __check_contours(self, fsz_mask):
         '''
         This method finding detected contours and corner coordinates
-        :fsz_mask: detected full size mask
+        :fsz_mask: detected full size binary mask with 0 and 255 values
         '''
         # load parameters
-        filter_area_size = self.model_parameters['filter_area_size']
+        filter_area_size = self.filter_area_size
 
         # finding contours
         first_cnt = True
-        _, thresh = cv2.threshold(fsz_mask, 0.5, 255, 0)
-        _, contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        _, contours, _ = cv2.findContours(fsz_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
 
-        for cnt in contours:
-            if cv2.contourArea(cnt) > filter_area_size:
-
-                # looking for coorner points
-                rect = cv2.minAreaRect(cnt)
-                box = cv2.boxPoints(rect)
-                box = np.float32(box)
-
-                # X and Y coordinates for center of detected rectangle
-                xm, ym = rect[0]
-
-                # detecting coordinates for each corner
-                # works for the first contour
-                if first_cnt:
-                    first_cnt = False
-                    for point in box:
-                        if point[0] < xm:
-                            if point[1] < ym:
-                                top_left = point
-                            else:
-                                bot_left = point
-                        else:
-                            if point[1] < ym:
-                                top_right = point
-                            else:
-                                bot_right = point
+        # filter small contours and keep only the largest ones, starting from the biggest
+        contour_areas = [(cv2.contourArea(cnt), cnt) for cnt in contours]
+        contour_areas = [item for item in contour_areas if item[0] > filter_area_size]
+        contour_areas.sort(key=lambda item: item[0], reverse=True)
+        contours = [cnt for _, cnt in contour_areas[:4]]
 
+        for cnt in contours:
+            # looking for coorner points
+            rect = cv2.minAreaRect(cnt)
+            box = cv2.boxPoints(rect)
+            box = np.float32(box)
+
+            # X coordinate for center of detected rectangle
+            xm = rect[0][0]
+
+            # ordering corners of the rectangle, the sum of coordinates is the smallest for top left
+            # and the largest for bottom right, their difference is the largest for top right
+            # and the smallest for bottom left
+            coord_sum = box.sum(axis=1)
+            coord_diff = box[:, 0] - box[:, 1]
+            box_top_left = box[coord_sum.argmin()]
+            box_bot_right = box[coord_sum.argmax()]
+            box_top_right = box[coord_diff.argmax()]
+            box_bot_left = box[coord_diff.argmin()]
+
+            # detecting coordinates for each corner
+            # works for the first contour
+            if first_cnt:
+                first_cnt = False
+                top_left, bot_left = box_top_left, box_bot_left
+                top_right, bot_right = box_top_right, box_bot_right
+
+                self.center_left = xm
+                self.center_right = xm
+
+            # works with more than one contour, and replace coordinates with more relevant
+            else:
+                # left side
+                if xm < self.center_left:
+                    top_left, bot_left = box_top_left, box_bot_left
                     self.center_left = xm
-                    self.center_right = xm
 
-                # works with more than one contour, and replace coordinates with more relevant
-                else:
-                    # left side
-                    if xm < self.center_left:
-                        for point in box:
-                            if point[0] < xm:
-                                if point[1] < ym:
-                                    top_left = point
-                                else:
-                                    bot_left = point
-                        self.center_left = xm
-
-                        # right side
-                    elif xm > self.center_right:
-                        for point in box:
-                            if point[0] > xm:
-                                if point[1] < ym:
-                                    top_right = point
-                                else:
-                                    bot_right = point
-                        self.center_right = xm
-
-                # fill spaces in contours
-                cv2.drawContours(fsz_mask, [cnt], -1, (1), -1)
+                # right side
+                elif xm > self.center_right:
+                    top_right, bot_right = box_top_right, box_bot_right
+                    self.center_right = xm
 
         # return if there is no detected area
         if first_cnt:
-            np.save('saved_frame_mask/frame{}.npy'.format(self.frame_num), np.zeros(1, dtype=np.uint8))
             return
 
-        # saving detected mask
-        np.save('saved_frame_mask/frame{}.npy'.format(self.frame_num), fsz_mask)
+        # saving corner points, dataframe is built from them before loading points
+        self.points_rows.append((top_left[0], top_left[1], top_right[0], top_right[1],
+                                 bot_left[0], bot_left[1], bot_right[0], bot_right[1]))
+        self.points_index.append(self.frame_num)
+
+    def __build_fp16_model(self, model_json):
+        '''
+        This method rebuilds the model with mixed float16 policy and copies trained weights into it
+        :model_json: model architecture in JSON format
+        :return: model with float16 computations
+        '''
+        # drop saved float32 dtypes so layers pick up the global policy
+        model_config = json.loads(model_json)
+        for layer in model_config['config']['layers']:
+            if layer['class_name'] != 'InputLayer':
+                layer['config'].pop('dtype', None)
 
-        # saving corner points to dataframe
-        self.saved_points.loc[self.frame_num] = [top_left[0], top_left[1], top_right[0],
-                                                 top_right[1], bot_left[0], bot_left[1],
-                                                 bot_right[0], bot_right[1]]
+        # keep output layer in float32 for numerically stable sigmoid
+        model_config['config']['layers'][-1]['config']['dtype'] = 'float32'
+
+        # build the model under mixed precision policy only
+        tf.keras.mixed_precision.experimental.set_policy('mixed_float16')
+        fp16_model = tf.keras.models.model_from_json(json.dumps(model_config))
+        tf.keras.mixed_precision.experimental.set_policy('float32')
+
+        # copy trained weights
+        fp16_model.set_weights(self.model.get_weights())
+
+        return fp16_model
 
     def __train_model(self, x_train_path, y_train_path, img_height, img_width, img_channels, model_weights_path):
         '''
@@ -214,24 +318,40 @@ class UnetLogoInsertion(AbstractBannerReplacer):
         :model_weights_path: model weight path for saving
         '''
         # looking for files
-        train_x_list = next(os.walk(x_train_path))[2]
-
-        # empty lists for X_traind and Y_train
-        x_train = np.zeros((len(train_x_list), img_height, img_width, img_channels), dtype=np.float32)
-        y_train = np.zeros((len(train_x_list), img_height, img_width, 1), dtype=np.float32)
-
-        # replacing empty lists elements with actual train data
-        n = 0
-        for file in train_x_list:
-            x_train_file = x_train_path + file
+        train_x_list = sorted(next(os.walk(x_train_path))[2])
+
+        # last 10% of files are used for validation
+        if len(train_x_list) < 2:
+            raise ValueError('at least 2 train files are required to split them into train and validation sets, '
+                             'found {} in {}'.format(len(train_x_list), x_train_path))
+        val_size = max(int(len(train_x_list) * 0.1), 1)
+        batch_size = 32
+
+        def load_pair(file):
+            # reading X image and Y mask for the file
+            file = file.decode()
             id_, _ = file.split('.')
-            y_train_file = y_train_path + id_ + '.npy'
-            x = cv2.imread(x_train_file, cv2.IMREAD_UNCHANGED)
-            y = np.load(y_train_file)
-            y_ = np.expand_dims(y, axis=-1)
-            x_train[n] = x
-            y_train[n] = y_
-            n += 1
+            x = cv2.imread(x_train_path + file, cv2.IMREAD_UNCHANGED).astype(np.float32)
+            y = np.expand_dims(np.load(y_train_path + id_ + '.npy'), axis=-1).astype(np.float32)
+            return x, y
+
+        def set_shapes(x, y):
+            x.set_shape((img_height, img_width, img_channels))
+            y.set_shape((img_height, img_width, 1))
+            return x, y
+
+        def make_dataset(files, shuffle, batch_size):
+            # files are decoded in parallel while the model is training on previous batch
+            dataset = tf.data.Dataset.from_tensor_slices(files)
+            if shuffle:
+                dataset = dataset.shuffle(len(files))
+            dataset = dataset.map(lambda file: tf.numpy_function(load_pair, [file], [tf.float32, tf.float32]),
+                                  num_parallel_calls=tf.data.experimental.AUTOTUNE)
+            dataset = dataset.map(set_shapes)
+            return dataset.batch(batch_size).prefetch(tf.data.experimental.AUTOTUNE)
+
+        train_dataset = make_dataset(train_x_list[:-val_size], shuffle=True, batch_size=batch_size)
+        val_dataset = make_dataset(train_x_list[-val_size:], shuffle=False, batch_size=batch_size)
 
         # setting callbacks for the model
         callbacks = [tf.keras.callbacks.EarlyStopping(monitor='val_loss', patience=10, verbose=0),
@@ -239,7 +359,7 @@ class UnetLogoInsertion(AbstractBannerReplacer):
                                                         save_best_only=True, save_weights_only=True)]
 
         # training the model
-        self.model.fit(x_train, y_train, validation_split=0.1, epochs=200, callbacks=callbacks)
+        self.model.fit(train_dataset, validation_data=val_dataset, epochs=200, callbacks=callbacks)
 
     def __loss(self, y_true, y_pred):
         '''
@@ -279,13 +399,17 @@ class UnetLogoInsertion(AbstractBannerReplacer):
         :return: transformed logo
         '''
 
-        # points before and after transformation
-        pts1 = np.float32(
-            [(0, 0), (0, (logo.shape[0] - 1)), ((logo.shape[1] - 1), (logo.shape[0] - 1)), ((logo.shape[1] - 1), 0)])
-        pts2 = np.float32([self.corners[0], self.corners[3], self.corners[1], self.corners[2]])
+        # points before transformation, the logo is loaded once so they are calculated only once
+        if self.logo_pts1 is None:
+            self.logo_pts1 = np.float32([(0, 0), (0, (logo.shape[0] - 1)), ((logo.shape[1] - 1), (logo.shape[0] - 1)),
+                                         ((logo.shape[1] - 1), 0)])
+        pts1 = self.logo_pts1
+
+        # points after transformation
+        pts2 = self.corners[[0, 3, 1, 2]]
 
         # crop frame when there is only part of it shown
-        if round(self.corners[1][0]) >= (self.frame.shape[1] - 1) or round(self.corners[2][0]) >= (
+        if np.rint(self.corners[1][0]) >= (self.frame.shape[1] - 1) or np.rint(self.corners[2][0]) >= (
                 self.frame.shape[1] - 1):  # works for right side
             # calculated X point
             transform_x = self.corners[0][0] + self.old_width
@@ -299,7 +423,7 @@ class UnetLogoInsertion(AbstractBannerReplacer):
             pts2 = np.float32(
                 [self.corners[0], self.corners[3], (transform_x, transform_y_bot), (transform_x, transform_y_top)])
 
-        elif round(self.corners[0][0]) <= 0 or round(self.corners[3][0]) <= 0:  # works for left side
+        elif np.rint(self.corners[0][0]) <= 0 or np.rint(self.corners[3][0]) <= 0:  # works for left side
             # calculated X point
             transform_x = self.corners[2][0] - self.old_width
 
@@ -323,27 +447,26 @@ class UnetLogoInsertion(AbstractBannerReplacer):
         :logo: the logo that we will change
         :return: changed logo
         '''
-        # select banner area
+        # select banner area, it is only read so a view of the frame is enough
         banner = self.frame[int(self.corners[0][1]):int(self.corners[1][1]),
-                 int(self.corners[0][0]):int(self.corners[1][0])].copy()
+                 int(self.corners[0][0]):int(self.corners[1][0])]
 
-        # get logo hsv
-        logo_hsv = cv2.cvtColor(logo, cv2.COLOR_BGR2HSV)
-        logo_h, logo_s, logo_v = cv2.split(logo_hsv)
+        # get logo hsv, the logo is loaded once so it is converted only once
+        if self.logo_hsv is None:
+            self.logo_hsv = cv2.cvtColor(logo, cv2.COLOR_BGR2HSV)
+            self.adjusted_logo_hsv = self.logo_hsv.copy()
+            self.mean_logo_s = int(np.mean(self.logo_hsv[..., 1]))
 
         # get banner hsv
         banner_hsv = cv2.cvtColor(banner, cv2.COLOR_BGR2HSV)
-        _, banner_s, _ = cv2.split(banner_hsv)
 
         # find the saturation difference between both images
-        mean_logo_s = np.mean(logo_s).astype(int)
-        mean_banner_s = np.mean(banner_s).astype(int)
-        trans_coef = round(mean_banner_s / mean_logo_s, 2)
+        mean_banner_s = int(cv2.mean(banner_hsv)[1])
+        trans_coef = round(mean_banner_s / self.mean_logo_s, 2)
 
-        # adjust logo saturation according to the difference
-        adjusted_logo_s = (logo_s * trans_coef).astype('uint8')
-        adjusted_logo_hsv = cv2.merge([logo_h, adjusted_logo_s, logo_v])
-        adjusted_logo = cv2.cvtColor(adjusted_logo_hsv, cv2.COLOR_HSV2BGR)
+        # adjust logo saturation according to the difference, hue and value stay the same
+        self.adjusted_logo_hsv[..., 1] = np.clip(self.logo_hsv[..., 1] * trans_coef, 0, 255)
+        adjusted_logo = cv2.cvtColor(self.adjusted_logo_hsv, cv2.COLOR_HSV2BGR)
 
         return adjusted_logo
 
@@ -354,9 +477,10 @@ class UnetLogoInsertion(AbstractBannerReplacer):
         :return: full size mask with detected banner pixels
         '''
         # load parameters
-        img_height = self.model_parameters['img_height']
-        img_width = self.model_parameters['img_width']
-        step = self.model_parameters['full_size_step']
+        img_height = self.img_height
+        img_width = self.img_width
+        step = self.full_size_step
+        batch_size = self.predict_batch_size
 
         # getting the frame size
         frame_height, frame_width, _ = self.frame.shape
@@ -364,35 +488,25 @@ class UnetLogoInsertion(AbstractBannerReplacer):
         # create mask for full size image prediction
         fsz_mask = np.zeros((frame_height, frame_width, 1), dtype='float32')
 
-        flag_k = False
-        flag_j = False
+        # split up the full frame to smaller images (same than using in model),
+        # the last row and column are aligned to the frame edge
+        anchors_k = sorted(set(range(0, frame_height - img_height + 1, step)) | {frame_height - img_height})
+        anchors_j = sorted(set(range(0, frame_width - img_width + 1, step)) | {frame_width - img_width})
 
-        # split up the full frame to smaller images (same than using in model) and predict them
-        for k in range(0, frame_height, step):
-            if k + img_height >= (frame_height - 1):
-                k = frame_height - img_height
-                flag_k = True
+        anchors = [(k, j) for k in anchors_k for j in anchors_j]
 
-            for j in range(0, frame_width, step):
-                if j + img_width >= (frame_width - 1):
-                    j = frame_width - img_width
-                    flag_j = True
+        # predict smaller images in batches of limited size to keep memory bounded
+        batch = np.empty((batch_size, img_height, img_width, self.frame.shape[2]), dtype=np.float32)
+        for start in range(0, len(anchors), batch_size):
+            batch_anchors = anchors[start:start + batch_size]
+            for i, (k, j) in enumerate(batch_anchors):
+                batch[i] = self.frame[k:k + img_height, j:j + img_width]
+            predictions = self.predict_fn(tf.constant(batch[:len(batch_anchors)])).numpy()
 
+            # keeping the highest predicted value for overlapped pixels
+            for i, (k, j) in enumerate(batch_anchors):
                 mask_cr = fsz_mask[k:k + img_height, j:j + img_width]
-                frame_cr = self.frame[k:k + img_height, j:j + img_width]
-                test_cr = np.expand_dims(frame_cr, axis=0)
-                cr_predict = self.model.predict(test_cr)
-
-                for y in range(img_height):
-                    for x in range(img_width):
-                        if cr_predict[0][y, x] > mask_cr[y, x]:
-                            mask_cr[y, x] = cr_predict[0][y, x]
-
-                if flag_j:
-                    break
-
-            if flag_k:
-                break
+                np.maximum(mask_cr, predictions[i].reshape(mask_cr.shape), out=mask_cr)
 
         return fsz_mask
 
@@ -400,156 +514,112 @@ class UnetLogoInsertion(AbstractBannerReplacer):
         '''
         The method loads smoothed points
         '''
-        # loading smoothed points for the 1st time and this is a video
-        if self.load_smooth and self.model_parameters['source_type'] == 0:
-            self.__smooth_points()
+        # building dataframe with saved points for the 1st time
+        if self.load_smooth:
+            self.saved_points = pd.DataFrame(self.points_rows, index=self.points_index,
+                                             columns=self.saved_points.columns)
+
+            # smoothing points if this is a video
+            if self.model_parameters['source_type'] == 0:
+                self.__smooth_points()
             self.load_smooth = False
 
-        # getiing points
-        top_left = (self.saved_points.loc[self.frame_num][0], self.saved_points.loc[self.frame_num][1])
-        top_right = (self.saved_points.loc[self.frame_num][2], self.saved_points.loc[self.frame_num][3])
-        bot_left = (self.saved_points.loc[self.frame_num][4], self.saved_points.loc[self.frame_num][5])
-        bot_right = (self.saved_points.loc[self.frame_num][6], self.saved_points.loc[self.frame_num][7])
+        # return if there is no detected area on the frame
+        if self.frame_num not in self.saved_points.index:
+            self.corners = None
+            return
+
+        # getiing points in order: top left, top right, bottom left, bottom right
+        points = self.saved_points.loc[self.frame_num].to_numpy()[:8].reshape(4, 2)
 
-        # saving coordinates
-        self.corners = [top_left, bot_right, top_right, bot_left]
+        # saving coordinates in order: top left, bottom right, top right, bottom left
+        self.corners = np.asarray(points[[0, 3, 1, 2]], dtype=np.float32)
 
     def __smooth_points(self):
         '''
         The method smoothes points
         '''
 
-        def get_distance(corner_x, corner_y):
-            return np.sqrt((self.saved_points['center_x'] - self.saved_points[corner_x]) ** 2 + (
-                    self.saved_points['center_y'] - self.saved_points[corner_y]) ** 2)
-
-        self.saved_points['center_x_1'] = (self.saved_points['x_top_left'] + self.saved_points['x_bot_right']) / 2
-        self.saved_points['center_y_1'] = (self.saved_points['y_top_left'] + self.saved_points['y_bot_right']) / 2
-        self.saved_points['center_x_2'] = (self.saved_points['x_top_right'] + self.saved_points['x_bot_left']) / 2
-        self.saved_points['center_y_2'] = (self.saved_points['y_top_right'] + self.saved_points['y_bot_left']) / 2
-
-        self.saved_points['center_x'] = (self.saved_points['center_x_1'] + self.saved_points['center_x_2']) / 2
-        self.saved_points['center_y'] = (self.saved_points['center_y_1'] + self.saved_points['center_y_2']) / 2
-
-        self.saved_points['dist_top_left'] = get_distance('x_top_left', 'y_top_left')
-        self.saved_points['dist_bot_left'] = get_distance('x_bot_left', 'y_bot_left')
-        self.saved_points['dist_top_right'] = get_distance('x_top_right', 'y_top_right')
-        self.saved_points['dist_bot_right'] = get_distance('x_bot_right', 'y_bot_right')
-
-        self.saved_points['left_height'] = np.sqrt(
-            (self.saved_points['x_top_left'] - self.saved_points['x_bot_left']) ** 2 + (
-                        self.saved_points['y_top_left'] - self.saved_points['y_bot_left']) ** 2)
-        self.saved_points['top_width'] = abs(self.saved_points['x_top_left'] - self.saved_points['x_top_right'])
-        self.saved_points['right_height'] = np.sqrt(
-            (self.saved_points['x_top_right'] - self.saved_points['x_bot_right']) ** 2 + (
-                        self.saved_points['y_top_right'] - self.saved_points['y_bot_right']) ** 2)
-        self.saved_points['bot_width'] = abs(self.saved_points['x_bot_left'] - self.saved_points['x_bot_right'])
-
-        self.saved_points['ratio'] = self.saved_points['top_width']/ self.saved_points['left_height']
-        ratio = 6.6
-
-        a = np.array(self.saved_points[['x_top_right', 'y_top_right']])
-        b = np.array(self.saved_points[['x_bot_left', 'y_bot_left']])
-
-        start_coordinate = np.array(self.saved_points[['x_top_left', 'y_top_left']])
+        def get_distance(point_a, point_b):
+            return np.hypot(point_a[:, 0] - point_b[:, 0], point_a[:, 1] - point_b[:, 1])
 
-        a = a - start_coordinate
-        b = b - start_coordinate
+        # corner coordinates with shape (N, 4, 2) in order: top left, top right, bottom left, bottom right
+        corners = self.saved_points[['x_top_left', 'y_top_left', 'x_top_right', 'y_top_right', 'x_bot_left',
+                                     'y_bot_left', 'x_bot_right', 'y_bot_right']].to_numpy(dtype=np.float64)
+        corners = corners.reshape(-1, 4, 2)
+        top_left, top_right, bot_left, bot_right = corners[:, 0], corners[:, 1], corners[:, 2], corners[:, 3]
 
-        self.saved_points['cos_alpha'] = np.sum(a * b, axis=1) / (np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1))
-        self.saved_points['angle'] = np.arccos(self.saved_points['cos_alpha']) * (180 / np.pi)
+        # center of the banner is the middle point of both diagonals
+        center = corners.mean(axis=1)
 
-        self.saved_points.drop(columns=['center_x_1', 'center_y_1', 'center_x_2', 'center_y_2'], inplace=True)
+        dist_top_left = get_distance(center, top_left)
+        left_height_arr = get_distance(top_left, bot_left)
+        right_height_arr = get_distance(top_right, bot_right)
+        top_width = np.abs(top_left[:, 0] - top_right[:, 0])
+        bot_width = np.abs(bot_left[:, 0] - bot_right[:, 0])
 
-        lost_side = []
-        prev_x = self.saved_points.loc[0]
-        for i in range(len(self.saved_points)):
-            data = self.saved_points.loc[i]
-            diff = data['dist_top_left'] - prev_x['dist_top_left']
-            if abs(diff) > 5:
-                lost_side.append(i)
-            prev_x = data
+        ratio_arr = top_width / left_height_arr
+        ratio = 6.6
 
-        unstable_left = np.zeros(self.saved_points.shape[0])
+        # angle of the top left corner
+        a = top_right - top_left
+        b = bot_left - top_left
+        cos_alpha = np.einsum('ij,ij->i', a, b) / (np.hypot(a[:, 0], a[:, 1]) * np.hypot(b[:, 0], b[:, 1]))
+        angle_arr = np.degrees(np.arccos(cos_alpha))
+
+        self.saved_points = self.saved_points.assign(center_x=center[:, 0],
+                                                     center_y=center[:, 1],
+                                                     dist_top_left=dist_top_left,
+                                                     dist_bot_left=get_distance(center, bot_left),
+                                                     dist_top_right=get_distance(center, top_right),
+                                                     dist_bot_right=get_distance(center, bot_right),
+                                                     left_height=left_height_arr,
+                                                     top_width=top_width,
+                                                     right_height=right_height_arr,
+                                                     bot_width=bot_width,
+                                                     ratio=ratio_arr,
+                                                     cos_alpha=cos_alpha,
+                                                     angle=angle_arr)
+
+        # coordinates corrected in place need their own arrays
+        x_top_left_arr = top_left[:, 0].copy()
+        x_top_right_arr = top_right[:, 0].copy()
+        x_bot_left_arr = bot_left[:, 0].copy()
+        x_bot_right_arr = bot_right[:, 0].copy()
+        y_top_left_arr = top_left[:, 1]
+        y_top_right_arr = top_right[:, 1]
+        points_num = len(x_top_left_arr)
+
+        # frames where distance to the top left corner jumps
+        lost_side = np.flatnonzero(np.abs(np.diff(dist_top_left)) > 5) + 1
+
+        unstable_left = np.zeros(points_num)
         unstable_right = np.zeros_like(unstable_left)
 
-        for i in lost_side:
-            if abs(self.saved_points.loc[i, 'x_top_left'] - self.saved_points.loc[i - 1, 'x_top_left']) > 9:
-                unstable_left[i] = 1
-
-            if abs(self.saved_points.loc[i, 'x_top_right'] - self.saved_points.loc[i - 1, 'x_top_right']) > 9:
-                unstable_right[i] = 1
+        unstable_left[lost_side[np.abs(x_top_left_arr[lost_side] - x_top_left_arr[lost_side - 1]) > 9]] = 1
+        unstable_right[lost_side[np.abs(x_top_right_arr[lost_side] - x_top_right_arr[lost_side - 1]) > 9]] = 1
 
         self.saved_points['unstable_right'] = unstable_right
         self.saved_points['unstable_left'] = unstable_left
 
-        x_top_left = self.saved_points["x_top_left"]
-        x_top_right = self.saved_points["x_top_right"]
-        y_top_right = self.saved_points["y_top_right"]
-        y_top_left = self.saved_points["y_top_left"]
-
-        y = lambda x: (x - x_top_left) * (y_top_right - y_top_left) / (x_top_right - x_top_left) + y_top_left
-
-        self.saved_points['y_top_right'] = y(self.saved_points['x_top_right'])
-        self.saved_points['y_bot_right'] = y(self.saved_points['x_bot_right']) + self.saved_points["left_height"]
-
-        latest_unstable = None
-        for x in range(self.saved_points.shape[0]):
-            row = self.saved_points.loc[x]
-            x_top_left = row["x_top_left"]
-            x_bot_left = row["x_bot_left"]
-            x_top_right = row["x_top_right"]
-            x_bot_right = row["x_bot_right"]
-            y_top_right = row["y_top_right"]
-            y_top_left = row["y_top_left"]
-
-            if row['unstable_right']:
-                latest_unstable = 'right'
-                for position in range(x - 10, x + 10):
-                    x_top_left = self.saved_points.loc[position, "x_top_left"]
-                    x_bot_left = self.saved_points.loc[position, "x_bot_left"]
-
-                    tmp_x_top_right = x_top_left + self.saved_points.loc[position, "left_height"] * \
-                                      (ratio * self.saved_points.loc[position, "angle"] / 90)
-                    tmp_x_bot_right = x_bot_left + self.saved_points.loc[position, "left_height"] * \
-                                      (ratio * self.saved_points.loc[position, "angle"] / 90)
-
-                    self.saved_points.loc[position, "x_top_right"] = tmp_x_top_right
-                    self.saved_points.loc[position, "x_bot_right"] = tmp_x_bot_right
-
-            if row['unstable_left']:
-                latest_unstable = 'left'
-                for position in range(x - 10, x + 10):
-                    x_top_right = self.saved_points.loc[position, "x_top_right"]
-                    x_bot_right = self.saved_points.loc[position, "x_bot_right"]
-
-                    tmp_x_top_left = x_top_right - self.saved_points.loc[position, "right_height"] * \
-                                     (ratio * self.saved_points.loc[position, "angle"] / 90)
-
-                    tmp_x_bot_left = x_bot_right - self.saved_points.loc[position, "right_height"] * \
-                                     (ratio * self.saved_points.loc[position, "angle"] / 90)
-
-                    self.saved_points.loc[position, "x_top_left"] = tmp_x_top_left
-                    self.saved_points.loc[position, "x_bot_left"] = tmp_x_bot_left
-
-            if abs(row['ratio'] - ratio) > 0.05:
-                if latest_unstable == 'left' and x_top_right <= 1278:
-                    tmp_x_top_left = x_top_right - self.saved_points.loc[x, "right_height"] * \
-                                     (ratio * self.saved_points.loc[x, "angle"] / 90)
-                    tmp_x_bot_left = x_bot_right - self.saved_points.loc[x, "right_height"] * \
-                                     (ratio * self.saved_points.loc[x, "angle"] / 90)
-
-                    self.saved_points.loc[x, "x_top_left"] = tmp_x_top_left
-                    self.saved_points.loc[x, "x_bot_left"] = tmp_x_bot_left
-
-                if latest_unstable == 'right' and x_top_left >= 2:
-                    tmp_x_top_right = x_top_left + self.saved_points.loc[x, "left_height"] * \
-                                      (ratio * self.saved_points.loc[x, "angle"] / 90)
-                    tmp_x_bot_right = x_bot_left + self.saved_points.loc[x, "left_height"] * \
-                                      (ratio * self.saved_points.loc[x, "angle"] / 90)
-
-                    self.saved_points.loc[x, "x_top_right"] = tmp_x_top_right
-                    self.saved_points.loc[x, "x_bot_right"] = tmp_x_bot_right
+        y = lambda x: (x - x_top_left_arr) * (y_top_right_arr - y_top_left_arr) / (
+                x_top_right_arr - x_top_left_arr) + y_top_left_arr
+
+        # aligning right corners to the top line
+        aligned_y_top_right = y(x_top_right_arr)
+        aligned_y_bot_right = y(x_bot_right_arr) + left_height_arr
+
+        # correcting coordinates of frames with lost side
+        _correct(unstable_left, unstable_right, x_top_left_arr, x_top_right_arr, x_bot_left_arr, x_bot_right_arr,
+                 left_height_arr, right_height_arr, angle_arr, ratio_arr, ratio)
+
+        # saving corrected coordinates
+        self.saved_points['x_top_left'] = x_top_left_arr
+        self.saved_points['x_top_right'] = x_top_right_arr
+        self.saved_points['x_bot_left'] = x_bot_left_arr
+        self.saved_points['x_bot_right'] = x_bot_right_arr
+        self.saved_points['y_top_right'] = aligned_y_top_right
+        self.saved_points['y_bot_right'] = aligned_y_bot_right
 
         self.saved_points['y_top_left'] = self.__smooth_series(self.saved_points['y_top_left'])
         self.saved_points['y_top_right'] = self.__smooth_series(self.saved_points['y_top_right'])
@@ -563,20 +633,24 @@ class UnetLogoInsertion(AbstractBannerReplacer):
         :return: smoothed coordinates
         '''
         # load parameters
-        min_window = self.model_parameters['min_window']
-        max_window = self.model_parameters['max_window']
-        poly_degree = self.model_parameters['poly_degree']
-        threshold = self.model_parameters['smooth_threshold']
+        min_window = self.min_window
+        max_window = self.max_window
+        poly_degree = self.poly_degree
+        threshold = self.smooth_threshold
 
         best_series = []
 
-        # smoothing
-        for wnd_size in range(min_window, max_window):
-            if wnd_size % 2 == 0:
-                continue
-            new_series = savgol_filter(series, wnd_size, poly_degree)
-            if max(abs(new_series - series)) < threshold:
+        # smoothing grows with window size, so binary search the largest odd window under the threshold
+        low_half = min_window // 2
+        high_half = (max_window - 2) // 2
+        while low_half <= high_half:
+            half = (low_half + high_half) // 2
+            new_series = savgol_filter(series, 2 * half + 1, poly_degree)
+            if np.max(np.abs(new_series - series)) < threshold:
                 best_series = new_series
+                low_half = half + 1
+            else:
+                high_half = half - 1
 
         return best_series
 